@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 """Extract talk mode icons as clean circles with transparent background"""
 from PIL import Image
+import numpy as np
 import os
-import math
+
+try:
+    import cv2  # optional: SIMD mask + boundingRect
+except ImportError:
+    cv2 = None
 
 media_dir = r'C:\Users\Liuho\ClawdBotHarmony\entry\src\main\resources\base\media'
 source = os.path.join(media_dir, 'talkmode.jpg')
@@ -13,66 +18,74 @@ print(f"Source size: {width}x{height}")
 
 mid = width // 2
 
+def find_colored_bbox(arr):
+    """Return (min_x, min_y, max_x, max_y) of the green/red circle, or None"""
+    if cv2 is not None:
+        # Same RGB rule as below; saturating subtract keeps g - r > 20 exact
+        r, g, _ = cv2.split(np.ascontiguousarray(arr))
+        _, g_hi = cv2.threshold(g, 120, 255, cv2.THRESH_BINARY)
+        _, g_dom = cv2.threshold(cv2.subtract(g, r), 20, 255, cv2.THRESH_BINARY)
+        _, r_hi = cv2.threshold(r, 120, 255, cv2.THRESH_BINARY)
+        _, r_dom = cv2.threshold(cv2.subtract(r, g), 20, 255, cv2.THRESH_BINARY)
+        mask = cv2.bitwise_or(cv2.bitwise_and(g_hi, g_dom), cv2.bitwise_and(r_hi, r_dom))
+        x, y, bw, bh = cv2.boundingRect(mask)
+        if bw == 0:
+            return None
+        return x, y, x + bw - 1, y + bh - 1
+    
+    r = arr[..., 0].astype(np.int16)
+    g = arr[..., 1].astype(np.int16)
+    mask = ((g > 120) & (g > r + 20)) | ((r > 120) & (r > g + 20))
+    # A bool array becomes a mode "1" image; getbbox scans it in C
+    bbox = Image.fromarray(mask).getbbox()
+    if bbox is None:
+        return None
+    left, upper, right, lower = bbox
+    return left, upper, right - 1, lower - 1
+
 def extract_circle_clean(img, output_path, target_size=96):
     """Extract just the colored circle with transparent background"""
-    pixels = img.load()
-    w, h = img.size
-    
-    # Find colored pixels (green or red circle)
-    colored_pixels = []
-    for y in range(h):
-        for x in range(w):
-            r, g, b = pixels[x, y]
-            is_green = g > 120 and g > r + 20
-            is_red = r > 120 and r > g + 20
-            if is_green or is_red:
-                colored_pixels.append((x, y))
+    arr = np.asarray(img)
     
-    if not colored_pixels:
+    # Find bounding box of colored pixels (green or red circle)
+    bbox = find_colored_bbox(arr)
+    if bbox is None:
         print(f"No colored circle found!")
         return
-    
-    # Find bounding box and center
-    min_x = min(p[0] for p in colored_pixels)
-    max_x = max(p[0] for p in colored_pixels)
-    min_y = min(p[1] for p in colored_pixels)
-    max_y = max(p[1] for p in colored_pixels)
+    min_x, min_y, max_x, max_y = bbox
     
     center_x = (min_x + max_x) // 2
     center_y = (min_y + max_y) // 2
     radius = max(max_x - min_x, max_y - min_y) // 2
     
-    # Create output image with transparent background
-    output = Image.new('RGBA', (target_size, target_size), (0, 0, 0, 0))
-    out_pixels = output.load()
+    h, w = arr.shape[:2]
     
     # Scale factor
     scale = target_size / (radius * 2)
     out_center = target_size // 2
     out_radius = target_size // 2
     
-    # Copy pixels that are within the circle
-    for out_y in range(target_size):
-        for out_x in range(target_size):
-            # Check if within circle
-            dx = out_x - out_center
-            dy = out_y - out_center
-            dist = math.sqrt(dx*dx + dy*dy)
-            
-            if dist <= out_radius:
-                # Map to source coordinates
-                src_x = int(center_x + dx / scale)
-                src_y = int(center_y + dy / scale)
-                
-                if 0 <= src_x < w and 0 <= src_y < h:
-                    r, g, b = pixels[src_x, src_y]
-                    # Check if this is part of the colored button (not background)
-                    is_green = g > 100 and g > r
-                    is_red = r > 100 and r > g
-                    is_white = r > 200 and g > 200 and b > 200  # White phone icon
-                    
-                    if is_green or is_red or is_white:
-                        out_pixels[out_x, out_y] = (r, g, b, 255)
+    # Map every output pixel to its nearest source pixel at once
+    dy, dx = np.mgrid[:target_size, :target_size] - out_center
+    in_circle = np.sqrt(dx * dx + dy * dy) <= out_radius
+    src_x = np.trunc(center_x + dx / scale).astype(np.intp)  # int() truncation
+    src_y = np.trunc(center_y + dy / scale).astype(np.intp)
+    valid = in_circle & (src_x >= 0) & (src_x < w) & (src_y >= 0) & (src_y < h)
+    rgb = np.zeros((target_size, target_size, 3), np.int16)
+    rgb[valid] = arr[src_y[valid], src_x[valid]]
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    
+    # Check if this is part of the colored button (not background)
+    is_green = (g > 100) & (g > r)
+    is_red = (r > 100) & (r > g)
+    is_white = (r > 200) & (g > 200) & (b > 200)  # White phone icon
+    keep = valid & (is_green | is_red | is_white)
+    
+    # Transparent background, opaque button pixels
+    rgba = np.zeros((target_size, target_size, 4), np.uint8)
+    rgba[keep, :3] = rgb[keep]
+    rgba[keep, 3] = 255
+    output = Image.fromarray(rgba)
     
     output.save(output_path, 'PNG')
     print(f"Saved {output_path} ({target_size}x{target_size})")
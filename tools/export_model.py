@@ -5,7 +5,13 @@ for on-device inference in ClawdbotHarmony.
 
 Usage:
     pip install torch transformers sentencepiece
-    python tools/export_model.py [--model MODEL_NAME] [--output OUTPUT_DIR]
+    python tools/export_model.py [--model MODEL_NAME] [--output OUTPUT_DIR] [--quantize {fp16,int8}]
+
+ONNX backend (dynamic INT8 quantization via ONNX Runtime):
+    pip install optimum[onnxruntime]
+    python tools/export_model.py --backend onnx
+  optimum loads and exports the model a second time (from the HuggingFace
+  cache, or downloaded if not cached); --quantize does not apply to it.
 
 Default model: sentence-transformers/all-MiniLM-L6-v2
 Default output: entry/src/main/resources/rawfile/model/
@@ -15,12 +21,58 @@ import argparse
 import json
 import os
 import struct
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
 MAGIC = 0x454D4231  # "EMB1"
+MAGIC_V2 = 0x454D4232  # "EMB2": adds a per-tensor dtype byte
+
+DTYPE_F16 = 0
+DTYPE_INT8 = 1  # int8 rows followed by one float32 scale per row
+
+# export_bin may run on worker threads; keep its status lines whole
+_print_lock = threading.Lock()
+
+IOV_MAX = 1024  # max buffers per os.writev call on Linux/macOS
+
+
+def quantize_int8(arr: np.ndarray):
+    """Symmetric per-row INT8 quantization of a 2-D weight matrix."""
+    arr = np.asarray(arr, dtype=np.float32)
+    scale = np.abs(arr).max(axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    q = np.round(arr / scale[:, None]).clip(-127, 127).astype(np.int8)
+    return q, scale.astype(np.float32)
 
 
-def export_bin(tensors: dict, output_path: str):
+def write_gathered(output_path: str, bufs: list):
+    """
+    Write byte buffers back to back with gathered os.writev calls, so the
+    header and every tensor go out in one syscall without concatenation.
+    Falls back to a buffered file where writev is unavailable (Windows).
+    """
+    if not hasattr(os, 'writev'):
+        with open(output_path, 'wb') as f:
+            for buf in bufs:
+                f.write(buf)
+        return
+
+    views = [memoryview(buf).cast('B') for buf in bufs]
+    with open(output_path, 'wb', buffering=0) as f:
+        fd = f.fileno()
+        while views:
+            written = os.writev(fd, views[:IOV_MAX])
+            # Drop fully written buffers and trim a partially written one
+            while views and written >= len(views[0]):
+                written -= len(views[0])
+                views.pop(0)
+            if written:
+                views[0] = views[0][written:]
+
+
+def export_bin(tensors: dict, output_path: str, quantize: str = 'fp16'):
     """
     Export tensors to binary file with header.
     Format:
@@ -28,31 +80,70 @@ def export_bin(tensors: dict, output_path: str):
       For each tensor:
         name_len(4B) + name(UTF-8) + ndim(4B) + shape(4B * ndim) + data_len(4B)
       Then concatenated float16 data for all tensors
+
+    With quantize='int8' the file uses MAGIC_V2: a dtype(1B) field is written
+    before data_len, and 2-D Linear weights (*.weight) are stored as int8
+    followed by float32 per-row scales. All other tensors stay float16.
     """
-    header = bytearray()
-    data = bytearray()
+    v2 = quantize == 'int8'
+    name_list = [name.encode('utf-8') for name in tensors]
+    dtype_len = 1 if v2 else 0
 
-    header += struct.pack('<I', MAGIC)
-    header += struct.pack('<I', len(tensors))
+    # Pre-size the header so fields are packed in place without reallocation
+    hdr_size = 8 + sum(4 + len(name_bytes) + 4 + 4 * arr.ndim + dtype_len + 4
+                       for name_bytes, arr in zip(name_list, tensors.values()))
+    header = bytearray(hdr_size)
+    struct.pack_into('<II', header, 0, MAGIC_V2 if v2 else MAGIC, len(tensors))
+    off = 8
+    arrays = []
 
-    for name, arr in tensors.items():
-        arr_f16 = arr.astype(np.float16)
-        name_bytes = name.encode('utf-8')
-        header += struct.pack('<I', len(name_bytes))
-        header += name_bytes
-        header += struct.pack('<I', len(arr_f16.shape))
-        for dim in arr_f16.shape:
-            header += struct.pack('<I', dim)
-        raw = arr_f16.tobytes()
-        header += struct.pack('<I', len(raw))
-        data += raw
+    for name_bytes, (name, arr) in zip(name_list, tensors.items()):
+        if v2 and name.endswith('.weight') and arr.ndim == 2:
+            dtype = DTYPE_INT8
+            payload = quantize_int8(arr)
+        else:
+            dtype = DTYPE_F16
+            payload = (np.ascontiguousarray(arr, dtype=np.float16),)
+        struct.pack_into('<I', header, off, len(name_bytes))
+        off += 4
+        header[off:off + len(name_bytes)] = name_bytes
+        off += len(name_bytes)
+        struct.pack_into(f'<{arr.ndim + 1}I', header, off, arr.ndim, *arr.shape)
+        off += 4 * (arr.ndim + 1)
+        if v2:
+            struct.pack_into('<B', header, off, dtype)
+            off += 1
+        struct.pack_into('<I', header, off, sum(a.nbytes for a in payload))
+        off += 4
+        arrays.extend(payload)
 
-    with open(output_path, 'wb') as f:
-        f.write(header)
-        f.write(data)
+    # Header and raw tensor bytes are written as one gathered write
+    write_gathered(output_path, [header] + [a.reshape(-1).view(np.uint8) for a in arrays])
+    data_len = sum(a.nbytes for a in arrays)
 
-    size_mb = (len(header) + len(data)) / (1024 * 1024)
-    print(f"  -> {output_path} ({size_mb:.1f} MB, {len(tensors)} tensors)")
+    size_mb = (len(header) + data_len) / (1024 * 1024)
+    with _print_lock:
+        print(f"  -> {output_path} ({size_mb:.1f} MB, {len(tensors)} tensors)")
+
+
+def export_onnx(model_name: str, onnx_dir: str):
+    """
+    Export the model to ONNX and apply dynamic INT8 quantization
+    (AVX-512 VNNI config). Writes model.onnx and model_quantized.onnx.
+    optimum loads the checkpoint itself, separately from the AutoModel
+    instance used for config and test vectors.
+    """
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    ort_model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    ort_model.save_pretrained(onnx_dir)
+    # Name the input explicitly: a rerun leaves model_quantized.onnx next to
+    # model.onnx, and a bare directory with several .onnx files is rejected
+    quantizer = ORTQuantizer.from_pretrained(onnx_dir, file_name='model.onnx')
+    qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False)
+    quantizer.quantize(save_dir=onnx_dir, quantization_config=qconfig)
+    print(f"  -> {os.path.join(onnx_dir, 'model_quantized.onnx')}")
 
 
 def main():
@@ -61,7 +152,20 @@ def main():
                         help='HuggingFace model name')
     parser.add_argument('--output', default=None,
                         help='Output directory (default: entry/src/main/resources/rawfile/model/)')
+    parser.add_argument('--quantize', choices=['fp16', 'int8'], default=None,
+                        help='Storage type for encoder/pooler Linear weights (default: fp16)')
+    parser.add_argument('--backend', choices=['bin', 'onnx'], default='bin',
+                        help='bin: EMB weight files for LocalTransformer; '
+                             'onnx: INT8 ONNX model in <output>/onnx/ (default: bin)')
+    parser.add_argument('--fp16-test-vectors', action='store_true',
+                        help='Run the test-vector forward pass under fp16 autocast on CUDA. '
+                             'Faster but less exact; do not use for the checked-in reference file')
     args = parser.parse_args()
+    if args.backend == 'onnx' and args.quantize is not None:
+        parser.error('--quantize only applies to --backend bin '
+                     '(the onnx backend always uses dynamic INT8)')
+    if args.quantize is None:
+        args.quantize = 'fp16'
 
     # Determine output directory
     if args.output:
@@ -74,8 +178,12 @@ def main():
     os.makedirs(out_dir, exist_ok=True)
     print(f"Exporting model: {args.model}")
     print(f"Output directory: {out_dir}")
+    print(f"Backend: {args.backend}")
+    if args.backend == 'bin':
+        print(f"Weight quantization: {args.quantize}")
 
     # Import here to allow --help without torch
+    import torch
     from transformers import AutoModel, AutoTokenizer
 
     print("Loading model and tokenizer...")
@@ -129,81 +237,99 @@ def main():
         json.dump(tok_config, f, indent=2)
     print(f"  -> {tok_path}")
 
-    # ---- 4. Export embeddings.bin ----
-    sd = model.state_dict()
-    emb_tensors = {}
-    prefix = 'embeddings.'
-    for key in sd:
-        if key.startswith(prefix):
-            short = key[len(prefix):]
-            emb_tensors[short] = sd[key].cpu().numpy()
-
-    export_bin(emb_tensors, os.path.join(out_dir, 'embeddings.bin'))
-
-    # ---- 5. Export layer weights ----
-    for layer_idx in range(config.num_hidden_layers):
-        layer_prefix = f'encoder.layer.{layer_idx}.'
-        layer_tensors = {}
-        for key in sd:
-            if key.startswith(layer_prefix):
-                short = key[len(layer_prefix):]
-                layer_tensors[short] = sd[key].cpu().numpy()
-
-        export_bin(layer_tensors, os.path.join(out_dir, f'layer_{layer_idx:02d}.bin'))
-
-    # ---- 6. Export pooler.bin ----
-    pooler_tensors = {}
-    for key in sd:
-        if key.startswith('pooler.'):
-            short = key[len('pooler.'):]
-            pooler_tensors[short] = sd[key].cpu().numpy()
-
-    if pooler_tensors:
-        export_bin(pooler_tensors, os.path.join(out_dir, 'pooler.bin'))
+    if args.backend == 'onnx':
+        # ---- 4. Export quantized ONNX model ----
+        # Kept in a subdirectory: save_pretrained writes its own config.json
+        export_onnx(args.model, os.path.join(out_dir, 'onnx'))
     else:
-        print("  (no pooler weights found)")
+        # Group state_dict tensors by output file in a single pass:
+        # 'embeddings', 'layer_N' (encoder.layer.N.*) and 'pooler'
+        groups = defaultdict(dict)
+        for key, value in model.state_dict().items():
+            parts = key.split('.', 3)
+            if parts[0] == 'encoder' and len(parts) == 4 and parts[1] == 'layer':
+                head, tail = f'layer_{int(parts[2])}', parts[3]
+            elif parts[0] in ('embeddings', 'pooler') and len(parts) > 1:
+                head, tail = parts[0], key[len(parts[0]) + 1:]
+            else:
+                continue
+            # Cast in torch so export_bin gets contiguous fp16 and skips its
+            # astype; .cpu() is free on CPU and keeps numpy() valid even if
+            # the model has been moved to another device
+            groups[head][tail] = value.detach().to(torch.float16).contiguous().cpu().numpy()
+
+        # ---- 4. Export embeddings.bin ----
+        # Always fp16: word embeddings are looked up row-by-row on device
+        export_bin(groups.get('embeddings', {}), os.path.join(out_dir, 'embeddings.bin'))
+
+        # ---- 5. Export layer weights ----
+        # Layer files are independent; overlap conversion with disk writes
+        jobs = [(groups.get(f'layer_{layer_idx}', {}),
+                 os.path.join(out_dir, f'layer_{layer_idx:02d}.bin'),
+                 args.quantize)
+                for layer_idx in range(config.num_hidden_layers)]
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            list(ex.map(lambda job: export_bin(*job), jobs))
+
+        # ---- 6. Export pooler.bin ----
+        pooler_tensors = groups.get('pooler')
+        if pooler_tensors:
+            export_bin(pooler_tensors, os.path.join(out_dir, 'pooler.bin'), args.quantize)
+        else:
+            print("  (no pooler weights found)")
 
     # ---- 7. Export test vectors for validation ----
-    import torch
     test_texts = [
         "Hello world",
         "This is a test sentence for embedding.",
         "The quick brown fox jumps over the lazy dog.",
     ]
     print("\nGenerating test vectors for validation...")
+    # fp32 by default so test_vectors.json matches the device's fp32 compute on
+    # any host; fp16 autocast is opt-in and CUDA-only
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    use_autocast = args.fp16_test_vectors and device == 'cuda'
+    if args.fp16_test_vectors and not use_autocast:
+        print("  (--fp16-test-vectors ignored: CUDA not available)")
+    model.to(device)
+    encoded = tokenizer(test_texts, padding='max_length', truncation=True,
+                        max_length=128, return_tensors='pt').to(device)
+    with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16,
+                                                enabled=use_autocast):
+        output = model(**encoded)
+    # Mean pooling over the whole batch (fp32)
+    token_embeddings = output.last_hidden_state.float()
+    attention_mask = encoded['attention_mask'].unsqueeze(-1).expand(token_embeddings.size()).float()
+    sum_embeddings = torch.sum(token_embeddings * attention_mask, dim=1)
+    sum_mask = torch.clamp(attention_mask.sum(dim=1), min=1e-9)
+    mean_pooled = sum_embeddings / sum_mask
+    # L2 normalize
+    normalized = torch.nn.functional.normalize(mean_pooled, p=2, dim=1)
+
     test_data = []
-    for text in test_texts:
-        encoded = tokenizer(text, padding='max_length', truncation=True,
-                            max_length=128, return_tensors='pt')
-        with torch.no_grad():
-            output = model(**encoded)
-        # Mean pooling
-        token_embeddings = output.last_hidden_state
-        attention_mask = encoded['attention_mask'].unsqueeze(-1).expand(token_embeddings.size()).float()
-        sum_embeddings = torch.sum(token_embeddings * attention_mask, dim=1)
-        sum_mask = torch.clamp(attention_mask.sum(dim=1), min=1e-9)
-        mean_pooled = sum_embeddings / sum_mask
-        # L2 normalize
-        normalized = torch.nn.functional.normalize(mean_pooled, p=2, dim=1)
-        vec = normalized[0].tolist()
-        token_ids = encoded['input_ids'][0].tolist()
+    token_lens = encoded['attention_mask'].sum(dim=1).tolist()
+    for i, text in enumerate(test_texts):
+        vec = normalized[i].tolist()
+        token_ids = encoded['input_ids'][i].tolist()
         test_data.append({
             'text': text,
-            'token_ids': token_ids[:sum(encoded['attention_mask'][0].tolist())],  # only non-pad
+            'token_ids': token_ids[:token_lens[i]],  # only non-pad
             'embedding': vec,
         })
         print(f"  '{text}' -> dim={len(vec)}, tokens={len(test_data[-1]['token_ids'])}")
 
     test_path = os.path.join(out_dir, 'test_vectors.json')
+    # Always json.dump: this is a checked-in golden file, so its separators
+    # and float repr must not depend on which optional packages are installed
     with open(test_path, 'w') as f:
         json.dump(test_data, f)
     print(f"  -> {test_path}")
 
     # Summary
     total_size = 0
-    for fname in os.listdir(out_dir):
-        fpath = os.path.join(out_dir, fname)
-        total_size += os.path.getsize(fpath)
+    for root, _, fnames in os.walk(out_dir):
+        for fname in fnames:
+            total_size += os.path.getsize(os.path.join(root, fname))
     print(f"\nTotal model size: {total_size / (1024 * 1024):.1f} MB")
     print("Export complete!")
 